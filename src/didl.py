@@ -1,13 +1,15 @@
 """DLNA AV classes"""
 
+import os
 import re
-import magic
-from .xml_ import element as xel
+import stat
 from pathlib import Path
+from functools import cached_property, lru_cache, partial
 from datetime import datetime
 from . import http_
-from xml.etree import ElementTree as Et
-from collections.abc import Generator
+from . import xml_
+from xml.sax.saxutils import escape
+from collections.abc import Generator, Iterator
 # import enum
 
 
@@ -106,6 +108,30 @@ from collections.abc import Generator
 #
 #     return ";".join(f"{key}={value}"for key, value in field.items())
 
+
+HEADER = ("<?xml version='1.0' encoding='utf-8'?>\n"
+          '<DIDL-Lite xmlns="{dlna}" xmlns:dc="{dc}" xmlns:upnp="{upnp}">'.format(**xml_.namespaces)).encode()
+FOOTER = b"</DIDL-Lite>"
+
+_escape_attrib = partial(escape, entities={'"': "&quot;", "\n": "&#10;", "\r": "&#13;", "\t": "&#09;"})
+
+@lru_cache(maxsize=4096)
+def _guess_mime(path: str, mtime: int, size: int) -> str:
+    """Guess a file's MIME type (cached per file version)"""
+    return http_.guess_mime(path, charset=False)
+
+
+@lru_cache(maxsize=8192)
+def _didl_fragment(url: str, id: str, parent_id: str, uclass: str, mime: str) -> bytes:
+    """Encoded DIDL-Lite XML of an object (cached, the arguments determine it)"""
+    tag = "container" if mime == "inode/directory" else "item"
+    out = (f'<{tag} id="{_escape_attrib(id)}" parentID="{_escape_attrib(parent_id)}">'
+           f'<upnp:class>{uclass}</upnp:class><dc:title>{escape(id.rpartition("/")[2])}</dc:title>')
+    if tag == "item":
+        out += f'<res protocolInfo="http-get:*:{mime}:DLNA.ORG_OP=01">{escape(http_.join_uri(url, id))}</res>'
+    return f"{out}</{tag}>".encode()
+
+
 class IdPath(http_.UrlPath):
     """ID as a path-like"""
 
@@ -136,36 +162,47 @@ class IdPath(http_.UrlPath):
 
 
 class Object:
-    def __init__(self, root: Path, url: str, id: str, command):
+    def __init__(self, root: Path, url: str, id: str, command, status: os.stat_result = None):
         self.root = root
         self.url = url
-        self.id_path = IdPath.from_id(id)
+        self.id = id
+        self.parent_id = id.rpartition("/")[0] or "0"  # TODO: check in TV, parent of root may need to be -1
         self.command = command
+        if status is not None:
+            self.status = status  # already known from the parent's listing
 
-    @property
+    @cached_property
+    def id_path(self) -> IdPath:
+        return IdPath.from_id(self.id)
+
+    @cached_property
     def path(self) -> Path:
         return self.id_path.as_path(self.root)
 
-    @property
+    @cached_property
+    def status(self) -> os.stat_result:
+        """File status (cached for the object's lifetime)"""
+        return os.stat(self.path)
+
+    @cached_property
+    def is_dir(self) -> bool:
+        return stat.S_ISDIR(self.status.st_mode)
+
+    @cached_property
     def mime(self) -> str:
-        return magic.detect_from_filename(self.path).mime_type
+        if self.is_dir:
+            return "inode/directory"
+        else:
+            return _guess_mime(str(self.path), self.status.st_mtime_ns, self.status.st_size)
 
-    @property
+    @cached_property
     def mime_type(self) -> str:
         return self.mime.split("/")[0]
 
-    @property
-    def qname(self) -> str:
-        """XML qualified tagname"""
-        if self.path.is_dir():
-            return "dlna:container"
-        else:
-            return "dlna:item"
-
     @property
     def uclass(self):
         """UPnP class path"""
-        if self.path.is_dir():
+        if self.is_dir:
             return "object.container"
         else:
             return f"object.item.{self.mime_type}Item"
@@ -175,32 +212,45 @@ class Object:
         if self.path == self.root:
             return int(datetime.now().timestamp())
         else:
-            return int(self.path.stat().st_mtime)
-
-    @property
-    def id(self) -> str:
-        return self.id_path.as_id()
+            return int(self.status.st_mtime)
 
-    @property
-    def parent_id(self) -> str:  # TODO: check in TV, parent of root may need to be -1 insted of root again
-        return self.id_path.parent.as_id()
+    @classmethod
+    def _scan(cls, path: str, id: str, recursive: bool = False) -> "Generator[tuple[str, os.DirEntry], None, None]":
+        """List directory entries with their IDs (recursion doesn't follow symlinks)"""
+        with os.scandir(path) as entries:
+            for entry in entries:
+                child = f"{id}/{entry.name}"
+                yield child, entry
+                if recursive and entry.is_dir() and not entry.is_symlink():
+                    yield from cls._scan(entry.path, child, recursive)
 
-    def __iter__(self) -> "Generator[Object, None, None]":
+    def _iter_children(self) -> "Generator[Object, None, None]":
+        """Construct the browsable children from a directory listing"""
         cls = self.__class__
-        if self.command == "browse":
-            result = self.path.glob("*")
+        id = "" if self.id == "0" else self.id
+        if not self.is_dir:  # items (e.g. in BrowseMetadata) have no children
+            result = []
+        elif self.command == "browse":
+            result = self._scan(self.path, id)
         elif self.command == "search":
-            result = self.path.rglob("*")
+            result = self._scan(self.path, id, recursive=True)
         else:
             result = []
-        for path in result:
-            element = cls(self.root, self.url, IdPath.from_path(self.root, path).as_id(), "browse")
-            if element.path.is_dir() or element.mime_type in {"image", "audio", "video"}:
+        for child, entry in result:
+            try:
+                status = entry.stat()
+            except OSError:  # broken symlink
+                continue
+            element = cls(self.root, self.url, child, "browse", status)
+            if element.is_dir or element.mime_type in {"image", "audio", "video"}:
                 yield element  # TODO: check in TV, is check needed or can we provide invalid upnp classes
 
-    @property
+    @cached_property
     def children(self) -> "list[Object]":
-        return list(iter(self))
+        return list(self._iter_children())
+
+    def __iter__(self) -> "Iterator[Object]":
+        return iter(self.children)
 
     def __getitem__(self, key):
         return self.children[key]
@@ -208,22 +258,10 @@ class Object:
     def __len__(self):
         return len(self.children)
 
-    @property
+    @cached_property
     def location(self) -> str:
-        return self.id_path.as_uri(self.url)
-
-    @property
-    def element(self) -> Et.Element:
-        attrs = {
-            "id": self.id,
-            "parentID": self.parent_id
-        }
-
-        root = xel(self.qname,
-                   xel("upnp:class", self.uclass),
-                   xel("dc:title", self.path.name), **attrs)
-
-        if not self.path.is_dir():
-            root.append(xel("dlna:res", self.location, protocolInfo=f"http-get:*:{self.mime}:DLNA.ORG_OP=01"))
+        return http_.join_uri(self.url, self.id)
 
-        return root
+    def didl_bytes(self) -> bytes:
+        """Encoded DIDL-Lite XML of the object"""
+        return _didl_fragment(self.url, self.id, self.parent_id, self.uclass, self.mime)
@@ -1,22 +1,77 @@
 """Extended HTTP server and handler"""
 
+import os
 import re
 from .net import LogServerMixIn
 from . import net
+import time
 import uuid
 import magic
 import socket
 import typing
+from threading import local
+from functools import lru_cache, cached_property
+from email.utils import formatdate
 from http import HTTPStatus
 from urllib import parse as urllib
 from pathlib import Path, PurePosixPath
-from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from contextlib import suppress, contextmanager
+from http.server import HTTPServer, BaseHTTPRequestHandler
 
 __all__ = (
-    "Server", "Handler", "Header", "Range", "UrlPath"
+    "Server", "Handler", "Header", "Range", "UrlPath", "join_uri", "detect_mime", "guess_mime"
 )
 
 
+_magics = local()  # libmagic handles are not thread-safe, each pool worker keeps its own
+
+
+def _magic() -> magic.Magic:
+    """Get the calling thread's libmagic handle (loading it on first use)"""
+    handle = getattr(_magics, "handle", None)
+    if handle is None:
+        handle = _magics.handle = magic.open(magic.MAGIC_MIME)
+        handle.load()
+    return handle
+
+
+def detect_mime(path: str, charset: bool = True) -> str:
+    """Detect a file's MIME type from its content (with or without the charset parameter)"""
+    mime = _magic().file(path)
+    return mime if charset else mime.partition(";")[0]
+
+
+# MIME types of common media extensions (as libmagic reports them)
+_media_types = {
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".png": "image/png",
+    ".gif": "image/gif",
+    ".mp3": "audio/mpeg",
+    ".flac": "audio/flac",
+    ".wav": "audio/x-wav",
+    ".mp4": "video/mp4",
+    ".m4v": "video/x-m4v",
+    ".mkv": "video/x-matroska",
+    ".webm": "video/webm",
+    ".avi": "video/x-msvideo",
+    ".mov": "video/quicktime",
+    ".mpg": "video/mpeg",
+    ".mpeg": "video/mpeg",
+}
+
+
+def guess_mime(path: str, charset: bool = True) -> str:
+    """Get a file's MIME type from its extension if it's common media, else from its content"""
+    return _media_types.get(os.path.splitext(path)[1].lower()) or detect_mime(path, charset)
+
+
+@lru_cache(maxsize=1)
+def _http_date(timestamp: int) -> str:
+    """Format a HTTP date (cached for the current second)"""
+    return formatdate(timestamp, usegmt=True)
+
+
 class UrlPath(PurePosixPath):
     """URL as a path-like"""
 
@@ -34,9 +89,14 @@ class UrlPath(PurePosixPath):
         if uri is None:
             return super().as_uri()
         else:
-            path = self.from_uri(uri) / self.relative_to("/")
-            path = urllib.urlsplit(path.as_uri()).path
-            return urllib.urlsplit(uri)._replace(path=path).geturl()
+            url_split = urllib.urlsplit(uri)
+            path = self.__class__("/", urllib.unquote(url_split.path), self.relative_to("/"))
+            return url_split._replace(path=urllib.quote_from_bytes(os.fsencode(path))).geturl()
+
+
+def join_uri(uri: str, path: str) -> str:
+    """Join an absolute path to a URI without query nor fragment (faster UrlPath.as_uri)"""
+    return uri.rstrip("/") + urllib.quote_from_bytes(os.fsencode(path))
 
 
 class Header:
@@ -58,13 +118,13 @@ class Range:
 
     _parser = re.compile(r'bytes=(\d+)-(\d+)?')
 
-    def __init__(self, path: Path, header: str = ""):
-        if match := self._parser.fullmatch(header):
+    def __init__(self, size: int, header: str = ""):
+        if match := header and self._parser.fullmatch(header):
             start, end = match.groups()
         else:
             start = end = None
         self._partial = bool(match)
-        self.size = path.stat().st_size
+        self.size = size
         self.start = int(start) if start else 0
         self.end = int(end) if end else self.size - 1
 
@@ -78,15 +138,18 @@ class Range:
         return self.end - self.start + 1
 
 
-class Server(LogServerMixIn, ThreadingHTTPServer):
+class Server(LogServerMixIn, net.ThreadPoolMixIn, HTTPServer):
     """HTTP server with complete address reuse and multicast support"""
 
     RequestHandlerClass: type[BaseHTTPRequestHandler]
 
     allow_multicast = False
+    send_buffer_size = 2 << 20
     
     def server_bind(self) -> None:
-        """Set socket options for address reuse and multicast membership"""
+        """Set socket options for address reuse, multicast membership and send buffer"""
+        if self.socket_type == socket.SOCK_STREAM:  # inherited by accepted sockets
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, self.send_buffer_size)
         if self.allow_reuse_address:
             self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
         if self.allow_multicast:  # TODO: not needed?
@@ -102,11 +165,23 @@ class Server(LogServerMixIn, ThreadingHTTPServer):
         """Server's Host URL"""
         return "http://{}:{}".format(*self.server_address)
 
-    @property
+    @cached_property
     def uuid(self) -> uuid.UUID:
         """Server's UUID (based on address)"""
         return uuid.uuid5(uuid.NAMESPACE_URL, self.host)
 
+    def reject_request(self, request, client_address) -> None:
+        """Reply Service Unavailable to a request that could not be queued"""
+        if isinstance(request, socket.socket):
+            with suppress(OSError):
+                request.sendall(b"HTTP/1.0 503 Service Unavailable\r\nContent-Length: 0\r\n\r\n")
+                request.shutdown(socket.SHUT_WR)
+                request.setblocking(False)
+                for _ in range(16):  # discard buffered input, closing with unread data resets the connection
+                    if not request.recv(1 << 16):
+                        break
+        super().reject_request(request, client_address)
+
     def handle_error(self, request, client_address):
         import sys
         from traceback import TracebackException
@@ -120,6 +195,7 @@ class Handler(BaseHTTPRequestHandler):
     """HTTP handler with flexible methods"""
 
     server: Server
+    timeout = 30  # seconds, idle or stalled connections give their pool worker back
 
     @property
     def host(self) -> str:
@@ -128,58 +204,82 @@ class Handler(BaseHTTPRequestHandler):
 
     def mime(self, path: Path) -> str:
         """Get MIME type from path"""
-        from contextlib import closing
-        with closing(magic.open(magic.MAGIC_MIME)) as mfd:
-            mfd.load()
-            return mfd.file(path)
+        return guess_mime(str(path))
 
     def copyfile(self, fp, offset: int = 0, count: int = None) -> None:
         """Copy file-like via zero-copy"""
         self.wfile.flush()
         socket_ = self.request if isinstance(self.request, socket.socket) else self.request[1]
 
-        from contextlib import suppress
-        with suppress(ConnectionError):
+        with suppress(ConnectionError, socket.timeout):
             socket_.sendfile(fp, offset, count)
 
+    @contextmanager
+    def corked(self):
+        """Only send full TCP segments while in context (on Linux)"""
+        if not hasattr(socket, "TCP_CORK") or not isinstance(self.request, socket.socket):
+            yield
+            return
+
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_CORK, 1)
+        try:
+            yield
+        finally:
+            with suppress(OSError):
+                self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_CORK, 0)
+
     def send_header(self, keyword: str, value) -> None:
         super().send_header(keyword, str(value))
 
-    def send_response_content(self, code: HTTPStatus, type: str, size: int):
-        self.send_response(code)
-        self.send_header(Header.CONTENT_TYPE, type)
-        self.send_header(Header.CONTENT_LENGTH, size)
+    def response_content(self, code: HTTPStatus, type: str, size: int, *headers: "tuple[str, typing.Any]") -> bytes:
+        """Log and format response line and headers (ending them)"""
+        self.log_request(code)
+        if self.request_version == "HTTP/0.9":
+            return b""
+        else:
+            lines = [
+                f"{self.protocol_version} {code.value} {code.phrase}",
+                f"{Header.SERVER}: {self.version_string()}",
+                f"{Header.DATE}: {_http_date(int(time.time()))}",
+                f"{Header.CONTENT_TYPE}: {type}",
+                f"{Header.CONTENT_LENGTH}: {size}",
+                *(f"{keyword}: {value}" for keyword, value in headers),
+                "", ""
+            ]
+            return "\r\n".join(lines).encode("latin-1", "strict")
+
+    def send_response_content(self, code: HTTPStatus, type: str, size: int, *headers: "tuple[str, typing.Any]"):
+        """Send response line and headers (ending them) in a single write"""
+        self.wfile.write(self.response_content(code, type, size, *headers))
 
     def send_file(self, path: Path, range: Range = None) -> None:
         """Send a file reply"""
         if range is None:
-            range = Range(path)
+            range = Range(path.stat().st_size)
 
         if len(range) <= 0:
             self.send_error(HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE)
             return
 
-        # Headers
-        status = HTTPStatus.PARTIAL_CONTENT if range else HTTPStatus.OK
-        self.send_response_content(status, self.mime(path), len(range))
-        if range:
-            self.send_header(Header.CONTENT_RANGE, range)
-        self.end_headers()
+        with self.corked():  # headers share the first segment with data
+            # Headers
+            if range:
+                self.send_response_content(HTTPStatus.PARTIAL_CONTENT, self.mime(path), len(range),
+                                           (Header.CONTENT_RANGE, range))
+            else:
+                self.send_response_content(HTTPStatus.OK, self.mime(path), len(range))
 
-        # Data
-        with path.open("rb") as fp:
-            self.copyfile(fp, range.start, len(range))
+            # Data
+            with path.open("rb") as fp:
+                self.copyfile(fp, range.start, len(range))
 
     def send_text(self, mime: str, text: str, code: HTTPStatus = HTTPStatus.OK) -> None:
         """Send a text reply"""
-        data = text.encode()
-
-        # Headers
-        self.send_response_content(code, mime, len(data))
-        self.end_headers()
+        self.send_bytes(mime, text.encode(), code)
 
-        # Data
-        self.wfile.write(data)
+    def send_bytes(self, mime: str, data: bytes, code: HTTPStatus = HTTPStatus.OK) -> None:
+        """Send a binary reply (headers and data in a single write)"""
+        self.wfile.write(self.response_content(code, mime, len(data)) + data)
 
     def parse_request(self) -> bool:
         """Replace invalid identifier charaters in command"""
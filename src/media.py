@@ -1,11 +1,18 @@
 """Digital Living Network Alliance Media Server"""
 
+import copy
+import select
+import stat
+import time
 import typing
 from . import xml_
 from . import http_
 from http import HTTPStatus
+from http.client import HTTPConnection, HTTPException, HTTPResponse
+from urllib.parse import urlsplit
 from collections.abc import Callable
 from pathlib import Path
+from threading import Lock
 
 
 __all__ = (
@@ -13,6 +20,14 @@ __all__ = (
 )
 
 
+_event_body = b'<e:propertyset xmlns:e="urn:schemas-upnp-org:event-1-0"></e:propertyset>'
+_event_headers = {
+    "Content-Type": 'text/xml; charset="utf-8"',
+    "NT": "upnp:event",
+    "NTS": "upnp:propchange",
+}
+
+
 class Server(http_.Server):
     """DLNA Media Server"""
 
@@ -32,6 +47,8 @@ class Server(http_.Server):
         MRR = http_.UrlPath("/media-receiver-registrar.xml")
         MEDIA = http_.UrlPath("/media/")
 
+    templates = Path("etc/templates")
+
     def __init__(self, address: tuple[str, int], handler: "Callable[..., Handler]", soap: "Callable",
                  name: str, media: Path):
         """Initialize media server"""
@@ -39,10 +56,89 @@ class Server(http_.Server):
         self.name = name
         self.media = media
         self._soap = soap
-
-    def get_template(self, name: str) -> Path:
-        """Get template path from its name"""
-        return Path("etc/templates", name).with_suffix(".xml")
+        self._sid_by_url: dict[str, str] = {}
+        self._event_conn: dict[tuple[str, int], tuple[HTTPConnection, float]] = {}
+        self._event_lock = Lock()
+        self._templates = {path.stem: xml_.parse(path) for path in self.templates.glob("*.xml")}
+
+        device = xml_.format(self.get_template("device-description"), friendlyName=self.name, UDN=self.uuid.urn)
+        self._static = {
+            self.paths.DEV: (xml_.MIME, xml_.serialize(device).encode()),
+            self.paths.SRV: (xml_.MIME, (self.templates / "content-directory2.xml").read_bytes()),
+            self.paths.NET: (xml_.MIME, (self.templates / "connection-manager2.xml").read_bytes()),
+            self.paths.MRR: (xml_.MIME, (self.templates / "media-receiver-registrar.xml").read_bytes()),
+        }
+
+    def get_template(self, name: str) -> "xml_.Et.Element":
+        """Get a copy of a parsed template from its name"""
+        return copy.deepcopy(self._templates[name])
+
+    def _take_event_connection(self, key: tuple[str, int]) -> typing.Optional[HTTPConnection]:
+        """Take the idle event connection to a subscriber"""
+        with self._event_lock:
+            connection, _ = self._event_conn.pop(key, (None, None))
+        return connection
+
+    def _keep_event_connection(self, key: tuple[str, int], connection: HTTPConnection, timeout: int) -> None:
+        """Keep an event connection for later events (replacing any other to the subscriber)"""
+        if connection.sock is None:  # closed by the response
+            return
+        with self._event_lock:
+            displaced, _ = self._event_conn.pop(key, (None, None))
+            self._event_conn[key] = connection, time.monotonic() + timeout
+        if displaced is not None:
+            displaced.close()
+
+    def _reap_event_connections(self, close_all: bool = False) -> None:
+        """Close the idle event connections that expired or were closed by the subscriber"""
+        now = time.monotonic()
+        with self._event_lock:
+            sockets = [connection.sock for connection, _ in self._event_conn.values()]
+            readable = set(select.select(sockets, [], [], 0)[0]) if sockets else set()  # EOF or unexpected data
+            for key, (connection, deadline) in list(self._event_conn.items()):
+                if close_all or deadline < now or connection.sock in readable:
+                    del self._event_conn[key]
+                    connection.close()
+
+    @staticmethod
+    def _notify(connection: HTTPConnection, path: str, headers: dict) -> HTTPResponse:
+        """Send an event and read its response"""
+        connection.request("NOTIFY", path, body=_event_body, headers=headers)
+        response = connection.getresponse()
+        response.read()
+        return response
+
+    def send_event(self, url: str, sid: str, timeout: int) -> HTTPResponse:
+        """Send an event to a subscriber, keeping its connection alive for later events"""
+        split = urlsplit(url)
+        key = (split.hostname, split.port)
+        headers = {**_event_headers, "SID": sid, "SEQ": "0"}
+
+        connection = self._take_event_connection(key)
+        if connection is not None:
+            try:
+                response = self._notify(connection, split.path, headers)
+            except (OSError, HTTPException):  # closed by the subscriber meanwhile
+                connection.close()
+                connection = None
+        if connection is None:
+            connection = HTTPConnection(*key, timeout=timeout)
+            try:
+                response = self._notify(connection, split.path, headers)
+            except BaseException:
+                connection.close()
+                raise
+
+        self._keep_event_connection(key, connection, timeout)
+        return response
+
+    def service_actions(self) -> None:
+        super().service_actions()
+        self._reap_event_connections()
+
+    def server_close(self) -> None:
+        super().server_close()
+        self._reap_event_connections(close_all=True)
 
 
 class Handler(http_.Handler):
@@ -62,28 +158,23 @@ class Handler(http_.Handler):
 
     def send_template(self, name: str, code: HTTPStatus = HTTPStatus.OK, **kwds):
         """Send a templated reply"""
-        path = self.server.get_template(name)
-        text = xml_.serialize(xml_.format(xml_.parse(path), **kwds))
-        self.send_text(self.mime(path), text, code)
+        text = xml_.serialize(xml_.format(self.server.get_template(name), **kwds))
+        self.send_text(xml_.MIME, text, code)
 
     def do_get(self):
         """Handle GET requests"""
-        if self.path == self.paths.MRR:
-            self.send_file(Path("etc/templates", self.paths.MRR.relative_to("/")))
-
-        elif self.path in {self.paths.SRV, self.paths.NET}:
-            self.send_file(Path("etc/templates", str(self.path.relative_to("/")).replace(".", "2.")))
-            #self.send_template(self.path.stem)
-
-        elif self.path == self.paths.DEV:
-            #self.send_file(Path("etc/templates", str(self.path.relative_to("/")).replace(".", "2.")))
-            self.send_template(self.path.stem, friendlyName=self.server.name, UDN=self.server.uuid.urn)
+        if static := self.server._static.get(self.path):
+            self.send_bytes(*static)
 
         elif self.path.is_relative_to(self.paths.MEDIA):
             path = self.server.media / self.path.relative_to(self.paths.MEDIA)
-            if path.is_file():
+            try:
+                status = path.stat()
+            except OSError:
+                status = None
+            if status and stat.S_ISREG(status.st_mode):
                 range = self.headers.get(http_.Header.RANGE, "")
-                self.send_file(path, http_.Range(path, range))
+                self.send_file(path, http_.Range(status.st_size, range))
             else:
                 self.send_error(HTTPStatus.NOT_FOUND)
 
@@ -113,7 +204,8 @@ class Handler(http_.Handler):
         if "Callback" in self.headers:
             import uuid
             url = self.headers["Callback"].strip("<>")
-            sid = uuid.uuid5(uuid.NAMESPACE_URL, url).urn[4:]
+            if (sid := self.server._sid_by_url.get(url)) is None:
+                sid = self.server._sid_by_url[url] = uuid.uuid5(uuid.NAMESPACE_URL, url).urn[4:]
             self.server.sub[sid] = url
             print("SUB=FIRST")
         else:
@@ -125,19 +217,5 @@ class Handler(http_.Handler):
         self.send_header("SID", sid)
         self.send_header("EXT", "")
         self.end_headers()
-        from http.client import HTTPConnection
-        from urllib.parse import urlsplit
-        split = urlsplit(url)
-        con = HTTPConnection(split.hostname, split.port, timeout=int(self.headers["Timeout"].split("-")[1]))
-        con.connect()
-        con.request("NOTIFY", split.path, body='<e:propertyset xmlns:e="urn:schemas-upnp-org:event-1-0"></e:propertyset>', headers={
-        "Content-Type": 'text/xml; charset="utf-8"',
-        "NT": "upnp:event",
-        "NTS": "upnp:propchange",
-        "SID": sid,
-        "SEQ": "0"
-        })
-        res = con.getresponse()
+        res = self.server.send_event(url, sid, int(self.headers["Timeout"].split("-")[1]))
         print(res.getheaders())
-        res.close()
-        con.close()
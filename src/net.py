@@ -1,16 +1,18 @@
 """Connection utilities"""
 
 from . import net
-import re
+import os
+import queue
 import socket
 import logging
 import socketserver as ss
-from threading import Thread
+from threading import Thread, BoundedSemaphore
 from collections import namedtuple
 from contextlib import contextmanager
 
 __all__ = (
-    "UDPServerMixIn", "UDPHandlerMixIn", "UDPClientMixIn", "with_server", "safe_identifier", "ip_membership"
+    "UDPServerMixIn", "UDPHandlerMixIn", "ThreadPoolMixIn", "with_server", "safe_identifier",
+    "ip_membership"
 )
 
 
@@ -19,12 +21,29 @@ UDPServerMixIn = mixin(ss.UDPServer, ss.TCPServer)
 UDPHandlerMixIn = mixin(ss.DatagramRequestHandler, ss.StreamRequestHandler)
 
 
-_re_alnum = re.compile(r"[^\w]+")
+# Lowercase ASCII word characters, map every other byte to a NUL separator
+_identifier_table = bytes(
+    ord(char.lower()) if char.isascii() and (char.isalnum() or char == "_") else 0
+    for char in map(chr, range(256))
+)
 
 
 def safe_identifier(method: str) -> str:
     """Transform a HTTP into a valid identifier"""
-    return _re_alnum.sub("_", method).lower()
+    data = method.encode("ascii", "replace").translate(_identifier_table)
+    if 0 not in data:
+        return data.decode("ascii")
+
+    # Collapse separator runs into a single underscore
+    identifier = bytearray()
+    separator = False
+    for byte in data:
+        if byte:
+            identifier.append(byte)
+        elif not separator:
+            identifier.append(ord("_"))
+        separator = not byte
+    return identifier.decode("ascii")
 
 
 def ip_membership(group: str, addr: str = "0.0.0.0") -> bytes:
@@ -32,37 +51,6 @@ def ip_membership(group: str, addr: str = "0.0.0.0") -> bytes:
     return socket.inet_aton(group) + socket.inet_aton(addr)
 
 
-class UDPClientMixIn:
-    """HTTP Client over UDP mix-in"""
-
-    host: str
-    port: int
-    source_address: tuple[str, int]
-    allow_reuse_address = False
-    allow_multicast = False
-
-    def connect(self) -> None:
-        """Connect to the host and port via UDP"""
-        # send to multicast addres; send though bind addres, if ADDR_ANY, send only though ip in defualt route
-        # so auto ip discovery imposible, need extra package
-        # however thant doesnt solve ssdp:alive not working, try send on same port?
-        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        if self.allow_reuse_address:
-            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
-        if self.allow_multicast:
-            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
-            self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1)
-            self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 4)
-        #if self.allow_multicast and self.source_address:
-            #print(f"MEMBER: GRP={self.host} IP={self.source_address[0]}")
-            #self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP,
-                                 #net.ip_membership(self.host, self.source_address[0]))
-        if self.source_address:
-            self.sock.bind(self.source_address)
-        self.sock.connect((self.host, self.port))
-
-
 from functools import cached_property
 
 class LogServerMixIn:
@@ -93,6 +81,70 @@ class LogServerMixIn:
     #         self.logger.info("handler stopped")
 
 
+class ThreadPoolMixIn(ss.ThreadingMixIn):
+    """Handle each request in a bounded pool of reused threads"""
+
+    daemon_threads = True
+    max_workers = (os.cpu_count() or 1) * 8
+    max_pending = 64
+
+    @cached_property
+    def _requests(self) -> queue.SimpleQueue:
+        """Queue of requests waiting for a worker (starts the workers)"""
+        requests = queue.SimpleQueue()
+        self._workers = [
+            Thread(target=self._work, args=(requests,), name=f"{self.__class__.__name__}-{index}",
+                   daemon=self.daemon_threads)
+            for index in range(self.max_workers)
+        ]
+        for worker in self._workers:
+            worker.start()
+        return requests
+
+    @cached_property
+    def _slots(self) -> BoundedSemaphore:
+        return BoundedSemaphore(self.max_workers + self.max_pending)
+
+    def _work(self, requests: queue.SimpleQueue) -> None:
+        """Process queued requests until a None sentinel"""
+        while (item := requests.get()) is not None:
+            try:
+                self.process_request_thread(*item)
+            finally:
+                self._slots.release()
+
+    def process_request(self, request, client_address) -> None:
+        """Queue the request in the pool, rejecting it when the pool is saturated"""
+        if self._slots.acquire(blocking=False):
+            self._requests.put((request, client_address))
+        else:
+            self.reject_request(request, client_address)
+
+    def reject_request(self, request, client_address) -> None:
+        """Drop a request that could not be queued"""
+        self.shutdown_request(request)
+
+    def server_close(self) -> None:
+        """Close the requests still queued and stop the workers"""
+        super().server_close()
+        if (requests := vars(self).get("_requests")) is None:
+            return
+
+        while True:
+            try:
+                request, _ = requests.get_nowait()
+            except queue.Empty:
+                break
+            self.shutdown_request(request)
+            self._slots.release()
+
+        for _ in self._workers:
+            requests.put(None)
+        if not self.daemon_threads and self.block_on_close:
+            for worker in self._workers:
+                worker.join()
+
+
 @contextmanager
 def with_server(server: ss.BaseServer):
     """Execute server in the background while in context"""
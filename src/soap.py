@@ -6,9 +6,9 @@ from . import media
 from . import didl
 from . import net
 from enum import IntEnum
+from functools import cached_property
 from http import HTTPStatus
-from .xml_ import element as xel
-from xml.etree import ElementTree as Et
+from lxml import etree as Et
 from pathlib import Path
 
 
@@ -33,6 +33,12 @@ class Status(IntEnum):
         self.phrase = phrase
         self.description = description
 
+    @cached_property
+    def fault(self) -> bytes:
+        """Encoded fault reply (rendered once per code)"""
+        template = xml_.parse(media.Server.templates / "fault.xml")
+        return xml_.serialize(xml_.format(template, errorCode=self.value, errorDescription=self.phrase)).encode()
+
     INVALID_ACTION = 401, "Invalid Action", "No action by that name at this service"  # noqa: E501
     INVALID_ARGS = 402, "Invalid Args", "Could be any of the following: not enough in args, args in the wrong order, one or more in args are of the wrong data type"  # noqa: E501
     INVALID_VAR = 404, "Invalid Var", "See UPnP Device Architecture section on Control"  # noqa: E501
@@ -71,6 +77,8 @@ class Status(IntEnum):
 class Handler:
     """SOAP handler with HTTP-like interface"""
 
+    __slots__ = ("request", "server", "paths", "service", "command", "data", "_raw")
+
     def __init__(self, request: media.Handler):
         """Prepare and handle request"""
         self.request = request
@@ -94,12 +102,12 @@ class Handler:
         size = int(self.request.headers.get(Header.CONTENT_LENGTH, 0))
         action = self.request.headers.get(Header.SOAP_ACTION, sep).strip('"')
 
-        self.service, self.command = action.split(sep)
-        self.command = net.safe_identifier(self.command)
-        data = self.request.rfile.read(size).decode()
+        self.service, _, command = action.partition(sep)
+        self.command = net.safe_identifier(command)
+        self._raw = data = self.request.rfile.read(size)
 
         try:
-            self.data = Et.fromstring(data)
+            self.data = xml_.fromstring(data)
         except Et.ParseError:
             self.send_error(Status.INVALID_ARGS)
             return False
@@ -115,22 +123,44 @@ class Handler:
     def send_error(self, code: Status) -> None:
         """Send error reply"""
         self.log_error("code %d, message %s", code.value, code.phrase)
-        self.request.send_template("fault", HTTPStatus.INTERNAL_SERVER_ERROR,
-                                   errorCode=str(code.value), errorDescription=code.phrase)
+        self.request.send_bytes(xml_.MIME, code.fault, HTTPStatus.INTERNAL_SERVER_ERROR)
+
+    def fast_find_text(self, name: bytes) -> "str | None":
+        """Scan the raw body for a plain argument's text (None unless it's certainly what parsing gives)"""
+        raw = self._raw
+        tag = b"<" + name
+        if b"<!" in raw or raw.find(b"<?", 1) >= 0:  # comments, CDATA, DOCTYPE or processing instructions
+            return None
+        if raw.count(tag) != 1 or b":" + name in raw:  # the tree could find another element first
+            return None
+        start = raw.find(tag + b">")
+        if start < 0:
+            return None
+        start += len(name) + 2
+        end = raw.find(b"<", start)
+        text = raw[start:end]
+        if not raw.startswith(b"</" + name + b">", end) or b"&" in text or b"\r" in text or not text.isascii():
+            return None
+        return text.decode("ascii")
+
+    def find_text(self, name: str) -> str:
+        """Find a argument's text, searching the parsed body if the raw scan fails"""
+        text = self.fast_find_text(name.encode())
+        return xml_.find_text(self.data, name) if text is None else text
 
     @property
     def browse_object(self) -> didl.Object:
         try:
-            id = xml_.find_text(self.data, "ObjectID")
+            id = self.find_text("ObjectID")
         except AttributeError:
-            id = xml_.find_text(self.data, "ContainerID")
+            id = self.find_text("ContainerID")
         url = self.paths.MEDIA.as_uri(self.request.host)
-        return didl.Object(self.server.media, url, id, self.command)
+        return didl.Object(self.server.media, url, didl.IdPath.from_id(id).as_id(), self.command)
 
     @property
     def browse_slice(self) -> slice:
-        start = int(xml_.find_text(self.data, "StartingIndex"))
-        size = int(xml_.find_text(self.data, "RequestedCount"))
+        start = int(self.find_text("StartingIndex"))
+        size = int(self.find_text("RequestedCount"))
         return slice(start, start + size)
 
     def do_getsearchcapabilities(self):
@@ -144,7 +174,7 @@ class Handler:
         element = self.browse_object  # TODO: check in TV, is BrowseMetadata necesary in allow list?
         self.log_message('"%s %s SOAP"', self.command.upper(), element.id_path)
 
-        children = [child.element for child in element[self.browse_slice]]
-        result = xml_.serialize(xel("dlna:DIDL-Lite", *children))
-        self.request.send_template(f"{self.command}-response", Result=result, UpdateID=element.update,
+        children = element[self.browse_slice]
+        result = b"".join([didl.HEADER, *(child.didl_bytes() for child in children), didl.FOOTER])
+        self.request.send_template(f"{self.command}-response", Result=result.decode(), UpdateID=element.update,
                                    TotalMatches=len(element), NumberReturned=len(children))
@@ -1,16 +1,18 @@
 """Simple Service Discovery Protocol"""
 
 from collections import namedtuple
+import heapq
 import socket
+import struct
+import time
 import typing
 from socketserver import BaseServer
 from . import http_
 from urllib.parse import urlsplit
-from collections.abc import Callable, Generator
+from collections.abc import Callable, Generator, Iterable
 from http import HTTPStatus
-from http.client import HTTPConnection
-from .net import LogServerMixIn, UDPServerMixIn, UDPHandlerMixIn, UDPClientMixIn
-from datetime import datetime
+from .net import LogServerMixIn, UDPServerMixIn, UDPHandlerMixIn
+from functools import lru_cache
 import threading
 
 from src import net
@@ -39,41 +41,51 @@ class Message:
     ALL = "ssdp:all"
 
 
+_unpack_u32 = struct.Struct("!I").unpack
+
+
 class Address(dict):
     ANY = "0.0.0.0"
     timeout = float("inf")
     _data = namedtuple("data", ["timeout", "packed"])
 
     def __init__(self, address: str, timeout: float):
+        self._deadlines: "list[tuple[float, str]]" = []  # heap, may hold stale deadlines of re-added addresses
         self.add(address)
         self.timeout = timeout
 
-    @staticmethod
-    def _now() -> int:
-        return int(datetime.now().timestamp())
+    _now = staticmethod(time.monotonic)
 
     @staticmethod
+    @lru_cache(maxsize=256)
     def _pack(address: str) -> int:
-        return int.from_bytes(socket.inet_aton(address), "big")
+        return _unpack_u32(socket.inet_aton(address))[0]
 
     def select(self, address: str) -> str:
-        packed = self._pack(address)
-        return min(self, key=lambda address: self[address].packed ^ packed, default=self.ANY)
+        packed = self._pack(address)  # XOR distances are unique, so tuples never compare by address
+        return min(((data.packed ^ packed, address) for address, data in self._entries()), default=(0, self.ANY))[1]
 
     def add(self, address: str) -> None:
-        self[address] = self._data(self._now() + self.timeout, self._pack(address))
+        deadline = self._now() + self.timeout
+        self[address] = self._data(deadline, self._pack(address))
+        heapq.heappush(self._deadlines, (deadline, address))
 
     def update(self) -> None:
         now = self._now()
-        for address in self:
-            if now > self[address].timeout:
+        while self._deadlines and now > self._deadlines[0][0]:
+            deadline, address = heapq.heappop(self._deadlines)
+            if address in self and self[address].timeout == deadline:
                 del self[address]
 
+    def _entries(self):
+        """Address data pairs, without ANY if another address is known"""
+        if Address.ANY in self and len(self) > 1:
+            return [(address, data) for address, data in self.items() if address != Address.ANY]
+        else:
+            return self.items()
+
     def __iter__(self):
-        copy = self.copy()
-        if Address.ANY in copy and len(copy) > 1:
-            del copy[Address.ANY]
-        return iter(copy)
+        return iter([address for address, _ in self._entries()])
 
 
 class Server(http_.Server, *UDPServerMixIn):  # type: ignore
@@ -94,6 +106,22 @@ class Server(http_.Server, *UDPServerMixIn):  # type: ignore
             for service in services.union({"upnp:rootdevice"})
         }
         self.targets[self.device] = self.device
+        self._notify_heads = {
+            (target, type): self._notify_head(target, type)
+            for target in self.targets for type in (Message.ALIVE, Message.BYE)
+        }
+
+    def _notify_head(self, target: str, type: str) -> bytes:
+        """Compose the address independent start of a NOTIFY datagram"""
+        lines = [
+            "NOTIFY * HTTP/1.1",
+            "HOST: 239.255.255.250:1900",
+            "SERVER: Ubuntu DLNADOC/1.50 UPnP/1.0 MiniDLNA/1.2.1",
+            f"{Header.NT}: {target}",
+            f"{Header.NTS}: {type}",
+            f"{Header.USN}: {self.targets[target]}",
+        ]
+        return "".join(f"{line}\r\n" for line in lines).encode("latin-1")
 
     @property
     def locations(self) -> Generator[str, None, None]:
@@ -115,39 +143,65 @@ class Server(http_.Server, *UDPServerMixIn):  # type: ignore
             return super().serve_forever()
 
 
-class C(UDPClientMixIn, HTTPConnection, BaseServer):
+class C(BaseServer):
     allow_reuse_address = 1
     allow_multicast = 1
+    source_port = 50927
+    notify_gap = 0.2  # seconds between repeated bursts
 
     def __init__(self, server: Server):
         self.server = server
         self.__shutdown_request = threading.Event()
         self.__is_shut_down = threading.Event()
-        super().__init__(*self.server.server_address)
+        self._sockets: "dict[str, socket.socket]" = {}
+
+    def open_socket(self, address: str) -> socket.socket:
+        """Open a UDP socket sending from address"""
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        if self.allow_reuse_address:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        if self.allow_multicast:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+            sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1)
+            sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 4)
+        sock.bind((address, self.source_port))
+        return sock
+
+    def socket_for(self, address: str) -> socket.socket:
+        """UDP socket sending from address (kept open across bursts)"""
+        if (sock := self._sockets.get(address)) is None:
+            sock = self._sockets[address] = self.open_socket(address)
+        return sock
+
+    def close_sockets(self, keep: "Iterable[str]" = ()) -> None:
+        """Close the sockets of addresses not kept"""
+        for address in self._sockets.keys() - set(keep):
+            self._sockets.pop(address).close()
 
     def send_notifies(self, type) -> None:
         self.server.addresses.update()
         self.logger.info("addresses %s", self.server.addresses)
+        self.close_sockets(self.server.addresses)
+        payloads = {address: self.build_notifies(type, address) for address in self.server.addresses}
         for _ in range(2):
-            for address in self.server.addresses:
-                for target in self.server.targets:
-                    self.send_notify(target, type, address)
-            import time
-            time.sleep(0.2)
-
-    def send_notify(self, target, type, address: str) -> None:
-        self.source_address = (address, 50927)
-        self.putrequest("NOTIFY", "*", skip_accept_encoding=True, skip_host=True)
-        self.putheader("HOST", "239.255.255.250:1900")
-        self.putheader("SERVER", "Ubuntu DLNADOC/1.50 UPnP/1.0 MiniDLNA/1.2.1")
-        self.putheader(Header.NT, target)
-        self.putheader(Header.NTS, type)
-        self.putheader(Header.USN, self.server.targets[target])
+            for address, datagrams in payloads.items():
+                sock = self.socket_for(address)
+                for payload in datagrams:
+                    sock.sendto(payload, self.server.server_address)
+            if type == Message.ALIVE:
+                self.__shutdown_request.wait(self.notify_gap)  # shutdown cuts the pause short
+            else:
+                time.sleep(self.notify_gap)  # keep the repeated byebyes apart even while shutting down
+
+    def build_notifies(self, type, address: str) -> "list[bytes]":
+        """Compose the NOTIFY datagrams of every target"""
+        tail = ""
         if type == Message.ALIVE and address != Address.ANY:
-            self.putheader(Header.CACHE_CONTROL.upper(), f"max-age={self.server.timeout}")
-            self.putheader(Header.LOCATION.upper(), self.server._replace_location(address))
-        self.endheaders()
-        self.close()
+            tail = (f"{Header.CACHE_CONTROL.upper()}: max-age={self.server.timeout}\r\n"
+                    f"{Header.LOCATION.upper()}: {self.server._replace_location(address)}\r\n")
+        tail = f"{tail}\r\n".encode("latin-1")
+        return [self.server._notify_heads[target, type] + tail for target in self.server.targets]
 
     def serve_forever(self):
         self.__shutdown_request.clear()
@@ -159,6 +213,7 @@ class C(UDPClientMixIn, HTTPConnection, BaseServer):
             if self.__shutdown_request.wait(self.server.timeout // 3):
                 break
         self.send_notifies(Message.BYE)
+        self.close_sockets()
         self.__is_shut_down.set()
 
     def shutdown(self):
@@ -175,6 +230,15 @@ class Handler(http_.Handler, *UDPHandlerMixIn):  # type: ignore
 
     server: Server
 
+    def parse_request(self) -> bool:
+        """Route unsupported requests to NOP"""
+        if super().parse_request():
+            if not hasattr(self, f"do_{self.command}"):
+                self.command = "nop"
+            return True
+        else:
+            return False
+
     def do_nop(self):
         """Handle NOP requests"""
 
@@ -203,10 +267,3 @@ class Handler(http_.Handler, *UDPHandlerMixIn):  # type: ignore
         self.send_header(Header.USN, self.server.targets[target])
         self.send_header(Header.CACHE_CONTROL, f"max-age={self.server.timeout}")
         self.end_headers()
-
-    def __getattr__(self, name):
-        """Ignore unsuported requests"""
-        if name.startswith("do_"):
-            return self.do_nop
-        else:
-            raise AttributeError(name)
@@ -1,15 +1,18 @@
 """XML constants and function helpers"""
 
-import re
+import copy
+from lxml import etree as Et
 from pathlib import Path
-from xml.etree import ElementTree as Et
+import threading
 
 
 __all__ = (
-    "parse", "serialize", "format", "element", "find_text"
+    "parse", "fromstring", "serialize", "format", "find_text"
 )
 
 
+MIME = 'text/xml; charset="utf-8"'
+
 namespaces = {
     # SOAP protocol
     "soap": "http://schemas.xmlsoap.org/soap/envelope/",
@@ -29,50 +32,52 @@ namespaces = {
 for prefix, uri in namespaces.items():
     Et.register_namespace(prefix, uri)
 
-_re_namespace = re.compile(r"{(.+)}")
-
+_parsers = threading.local()  # lxml parsers can't be shared between threads
+_find_unqualified = Et.XPath(".//*[namespace-uri()='']")
+_find_local = Et.XPath(".//*[local-name()=$name]")
 
-def _qname(namespace: str, local: str) -> str:
-    """Construct a namespaced tagname"""
-    return str(Et.QName(namespaces[namespace], local))
 
+def parse(path: Path) -> Et.Element:
+    """Parse XML data from a Path object"""
+    return Et.parse(str(path)).getroot()
 
-def element(qname: str, *args, **kwds) -> Et.Element:
-    """Construct a namespaced element"""
-    namespace, local = qname.split(":")
-    element = Et.Element(_qname(namespace, local), {
-        _qname(namespace, key): str(value)
-        for key, value in kwds.items()
-    })
-
-    for arg in args:
-        if isinstance(arg, Et.Element):
-            element.append(arg)
-        else:
-            element.text = str(arg)
 
-    return element
+def fromstring(data: bytes) -> Et.Element:
+    """Parse untrusted XML data (without entity expansion or network access)"""
+    parser = getattr(_parsers, "parser", None)
+    if parser is None:
+        parser = _parsers.parser = Et.XMLParser(resolve_entities=False, no_network=True, huge_tree=False)
+    return Et.fromstring(data, parser)
 
 
-def parse(path: Path) -> Et.Element:
-    """Parse XML data from a Path object"""
-    return Et.parse(str(path)).getroot()
+def _default_namespace(element: Et.Element, namespace: str) -> Et.Element:
+    """Copy element into an equal element declaring namespace as the default"""
+    used = {Et.QName(key).namespace for key in element.attrib}
+    nsmap = {prefix: uri for prefix, uri in element.nsmap.items() if prefix is not None and uri in used}
+    root = Et.Element(element.tag, element.attrib, nsmap={None: namespace, **nsmap})
+    root.text = element.text
+    root.extend(copy.deepcopy(child) for child in element)
+    return root
 
 
 def serialize(element: Et.Element) -> str:
     """Serialize a XML element to a string"""
-    match = _re_namespace.search(element.tag)
-    if match is None or element.find(".//{}*") is not None:
-        namespace = None
-    else:
-        namespace = match[1]
-    return Et.tostring(element, encoding="unicode", xml_declaration=True, default_namespace=namespace)
+    tag = element.tag
+    if tag.startswith("{") and not _find_unqualified(element):
+        element = _default_namespace(element, tag[1:tag.index("}")])
+    return Et.tostring(element, encoding="utf-8", xml_declaration=True).decode()
+
+
+def _find(element: Et.Element, local: str) -> "Et.Element | None":
+    """Find the first descendant with a local name in any namespace"""
+    found = _find_local(element, name=local)
+    return found[0] if found else None
 
 
 def format(element: Et.Element, /, **kwds) -> Et.Element:
     """Format XML tag's text content"""
     for key, value in kwds.items():
-        el = element.find(f".//{{*}}{key}")
+        el = _find(element, key)
         if el is None:
             raise AttributeError(key)
         else:
@@ -82,7 +87,7 @@ def format(element: Et.Element, /, **kwds) -> Et.Element:
 
 def find_text(element: Et.Element, qname: str) -> str:
     """Find element and get its inner text (default empty)"""
-    el = element.find(f".//{{*}}{qname}")
+    el = _find(element, qname)
     if el is None:
         raise AttributeError(qname)
     elif el.text: